@@ -0,0 +1,443 @@
+"""
+Offline benchmark and load test for the face service.
+
+Drives the ASGI app in-process (no network, no extra dependencies) with a
+directory of sample faces and reports:
+  - single-request latency percentiles for /get-embedding,
+    /compare-embeddings and /verify-face
+  - throughput and latency of /get-embedding at increasing concurrency
+  - peak RSS of the service process and of its largest worker process
+  - cold start: module import, first embedding and peak RSS in a fresh
+    interpreter
+
+Results are written as JSON and can be checked against a saved baseline;
+the exit status is 1 when any metric regresses by more than --threshold.
+Service settings come from the usual environment variables, e.g.
+
+  python benchmark.py --save-baseline bench-baseline.json
+  FACE_WORKERS=4 python benchmark.py --baseline bench-baseline.json
+  FACE_PIPELINE=single-pass python benchmark.py --output single-pass.json
+
+The embedding cache is disabled unless --with-cache is given, so repeated
+sample images are measured rather than served from memory.
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import platform
+import resource
+import shutil
+import tempfile
+import subprocess
+
+import numpy as np
+
+DEFAULT_IMAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server", "data", "faces")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Metrics compared against a baseline: lower is better unless listed here
+HIGHER_IS_BETTER = ("rps",)
+
+def _load_images(directory):
+  images = []
+  for name in sorted(os.listdir(directory)):
+    if name.lower().endswith(IMAGE_EXTENSIONS):
+      with open(os.path.join(directory, name), "rb") as fh:
+        images.append((name, fh.read()))
+  return images
+
+def _configure_environment(with_cache):
+  """Settings that must be in place before main is imported.
+
+  Returns the temporary index directory it created, if any, for removal.
+  """
+  if not with_cache:
+    os.environ["FACE_CACHE_MAX_BYTES"] = "0"
+  # Keep benchmark enrollments out of the real index
+  if "FACE_INDEX_DIR" in os.environ:
+    return None
+  index_dir = tempfile.mkdtemp(prefix="face-bench-index-")
+  os.environ["FACE_INDEX_DIR"] = index_dir
+  return index_dir
+
+def _multipart(files):
+  """Encode [(field, filename, bytes)] as a multipart/form-data body"""
+  boundary = uuid.uuid4().hex
+  parts = []
+  for field, filename, data in files:
+    parts.append(
+      f"--{boundary}\r\n"
+      f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+      f"Content-Type: application/octet-stream\r\n\r\n".encode() + data + b"\r\n"
+    )
+  parts.append(f"--{boundary}--\r\n".encode())
+  return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+async def _asgi_request(app, method, path, body=b"", content_type=None):
+  """Send one request through the ASGI app, returning (status, body)"""
+  path, _, query = path.partition("?")
+  headers = [(b"host", b"benchmark"), (b"content-length", str(len(body)).encode())]
+  if content_type:
+    headers.append((b"content-type", content_type.encode()))
+  scope = {
+    "type": "http",
+    "asgi": {"version": "3.0"},
+    "http_version": "1.1",
+    "method": method,
+    "scheme": "http",
+    "path": path,
+    "raw_path": path.encode(),
+    "query_string": query.encode(),
+    "root_path": "",
+    "headers": headers,
+    "client": ("127.0.0.1", 0),
+    "server": ("benchmark", 80)
+  }
+  sent = False
+  finished = asyncio.Event()
+  response = {"status": None, "body": []}
+
+  async def receive():
+    nonlocal sent
+    if not sent:
+      sent = True
+      return {"type": "http.request", "body": body, "more_body": False}
+    await finished.wait()
+    return {"type": "http.disconnect"}
+
+  async def send(message):
+    if message["type"] == "http.response.start":
+      response["status"] = message["status"]
+    elif message["type"] == "http.response.body":
+      response["body"].append(message.get("body", b""))
+      if not message.get("more_body"):
+        finished.set()
+
+  await app(scope, receive, send)
+  return response["status"], b"".join(response["body"])
+
+def _summarize(latencies_s, errors=0):
+  if not latencies_s:
+    return {"n": 0, "errors": errors}
+  ms = np.array(latencies_s) * 1000
+  return {
+    "n": len(latencies_s),
+    "errors": errors,
+    "mean_ms": round(float(ms.mean()), 2),
+    "p50_ms": round(float(np.percentile(ms, 50)), 2),
+    "p90_ms": round(float(np.percentile(ms, 90)), 2),
+    "p95_ms": round(float(np.percentile(ms, 95)), 2),
+    "p99_ms": round(float(np.percentile(ms, 99)), 2)
+  }
+
+async def _timed(app, *request):
+  start = time.perf_counter()
+  status, body = await _asgi_request(app, *request)
+  return status, body, time.perf_counter() - start
+
+async def _bench_latency(app, images, requests):
+  """Sequential requests per endpoint"""
+  results = {}
+
+  # /get-embedding
+  latencies, errors, embeddings = [], 0, []
+  for i in range(requests):
+    name, data = images[i % len(images)]
+    body, content_type = _multipart([("image", name, data)])
+    status, payload, elapsed = await _timed(app, "POST", "/get-embedding", body, content_type)
+    if status == 200:
+      latencies.append(elapsed)
+      if len(embeddings) < 2:
+        embeddings.append(json.loads(payload)["embedding"])
+    else:
+      errors += 1
+  results["/get-embedding"] = _summarize(latencies, errors)
+
+  # /compare-embeddings
+  latencies, errors = [], 0
+  if len(embeddings) == 2:
+    body = json.dumps({"embA": embeddings[0], "embB": embeddings[1]}).encode()
+    for _ in range(requests):
+      status, _, elapsed = await _timed(app, "POST", "/compare-embeddings", body, "application/json")
+      if status == 200:
+        latencies.append(elapsed)
+      else:
+        errors += 1
+  results["/compare-embeddings"] = _summarize(latencies, errors)
+
+  # /verify-face
+  latencies, errors = [], 0
+  for i in range(requests):
+    name_a, data_a = images[i % len(images)]
+    name_b, data_b = images[(i + 1) % len(images)]
+    body, content_type = _multipart([("imageA", name_a, data_a), ("imageB", name_b, data_b)])
+    status, _, elapsed = await _timed(app, "POST", "/verify-face", body, content_type)
+    if status == 200:
+      latencies.append(elapsed)
+    else:
+      errors += 1
+  results["/verify-face"] = _summarize(latencies, errors)
+
+  return results
+
+async def _bench_throughput(app, images, concurrency, requests_per_client):
+  """Closed-loop load: `concurrency` clients each sending requests back to back"""
+  bodies = [_multipart([("image", name, data)]) for name, data in images]
+  latencies, statuses = [], []
+
+  async def client(offset):
+    for i in range(requests_per_client):
+      body, content_type = bodies[(offset + i) % len(bodies)]
+      status, _, elapsed = await _timed(app, "POST", "/get-embedding", body, content_type)
+      statuses.append(status)
+      if status == 200:
+        latencies.append(elapsed)
+
+  start = time.perf_counter()
+  await asyncio.gather(*[client(c) for c in range(concurrency)])
+  elapsed = time.perf_counter() - start
+
+  summary = _summarize(latencies, sum(1 for s in statuses if s not in (200, 503)))
+  summary.update({
+    "concurrency": concurrency,
+    "requests": len(statuses),
+    "busy": statuses.count(503),
+    "seconds": round(elapsed, 3),
+    "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0
+  })
+  return summary
+
+def _collect_garbage():
+  """Worker job: run the full collection that MediaPipe's objects would
+  otherwise trigger a dozen requests in (a ~100-200 ms pause)"""
+  gc.collect()
+  # Hold the worker briefly so concurrent jobs land on different workers
+  time.sleep(0.05)
+
+async def _warm_up(app, engine, images, rounds):
+  """Build models on every worker before anything is timed.
+
+  Executors start workers on demand and each worker builds its own
+  MediaPipe graphs, so every round sends one request per worker at once.
+  """
+  workers = engine.workers
+  async def request(i):
+    name, data = images[i % len(images)]
+    body, content_type = _multipart([("image", name, data)])
+    await _asgi_request(app, "POST", "/get-embedding", body, content_type)
+
+  for round_ in range(rounds):
+    await asyncio.gather(*[request(round_ * workers + i) for i in range(workers)])
+  await asyncio.gather(*[engine.run(_collect_garbage) for _ in range(workers)])
+  gc.collect()
+
+def _cold_start(image_path, with_cache):
+  """Time import and first embedding in a fresh interpreter"""
+  start = time.perf_counter()
+  completed = subprocess.run(
+    [sys.executable, os.path.abspath(__file__), "--cold-start-probe", image_path]
+    + (["--with-cache"] if with_cache else []),
+    capture_output=True,
+    text=True,
+    cwd=os.path.dirname(os.path.abspath(__file__))
+  )
+  total = time.perf_counter() - start
+  lines = [line for line in completed.stdout.splitlines() if line.startswith("{")]
+  if completed.returncode != 0 or not lines:
+    return {"error": completed.stderr.strip().splitlines()[-1:] or ["probe failed"]}
+  probe = json.loads(lines[-1])
+  probe["total_s"] = round(total, 3)
+  return probe
+
+def _cold_start_probe(image_path):
+  start = time.perf_counter()
+  import main
+  imported = time.perf_counter()
+  with open(image_path, "rb") as fh:
+    body, content_type = _multipart([("image", os.path.basename(image_path), fh.read())])
+  status, _ = asyncio.run(_asgi_request(main.app, "POST", "/get-embedding", body, content_type))
+  done = time.perf_counter()
+  main.engine.shutdown()
+  print(json.dumps({
+    "import_s": round(imported - start, 3),
+    "first_request_s": round(done - imported, 3),
+    "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+    "status": status
+  }))
+  return 0 if status == 200 else 1
+
+def _peak_rss_mb(who):
+  # ru_maxrss is KiB on Linux and bytes on macOS
+  rss = resource.getrusage(who).ru_maxrss
+  scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+  return round(rss / scale, 1)
+
+def _flatten(results):
+  """Comparable metrics as {name: value}"""
+  flat = {}
+  for endpoint, summary in results.get("latency", {}).items():
+    for key in ("p50_ms", "p95_ms"):
+      if key in summary:
+        flat[f"latency{endpoint}.{key}"] = summary[key]
+  for summary in results.get("throughput", []):
+    prefix = f"throughput.c{summary['concurrency']}"
+    flat[f"{prefix}.rps"] = summary["rps"]
+    if "p95_ms" in summary:
+      flat[f"{prefix}.p95_ms"] = summary["p95_ms"]
+  memory = results.get("memory", {})
+  for key in ("peak_rss_mb", "peak_rss_worker_mb"):
+    if memory.get(key) is not None:
+      flat[f"memory.{key}"] = memory[key]
+  cold_start = results.get("cold_start") or {}
+  for key in ("total_s", "peak_rss_mb"):
+    if key in cold_start:
+      flat[f"cold_start.{key}"] = cold_start[key]
+  return flat
+
+def _compare(results, baseline, threshold):
+  """List of (metric, baseline, current, change, regressed)"""
+  current = _flatten(results)
+  rows = []
+  for name, base in _flatten(baseline).items():
+    if name not in current or not base:
+      continue
+    value = current[name]
+    change = (value - base) / base
+    if name.endswith(HIGHER_IS_BETTER):
+      regressed = change < -threshold
+    else:
+      regressed = change > threshold
+    rows.append((name, base, value, change, regressed))
+  return rows
+
+def _print_results(results):
+  print("Latency (sequential):")
+  for endpoint, summary in results["latency"].items():
+    if summary["n"]:
+      print(
+        f"  {endpoint:<20} p50 {summary['p50_ms']:>8} ms  p95 {summary['p95_ms']:>8} ms"
+        f"  p99 {summary['p99_ms']:>8} ms  (n={summary['n']}, errors={summary['errors']})"
+      )
+    else:
+      print(f"  {endpoint:<20} no successful requests (errors={summary['errors']})")
+  print("Throughput (/get-embedding):")
+  for summary in results["throughput"]:
+    print(
+      f"  c={summary['concurrency']:<3} {summary['rps']:>7} req/s"
+      f"  p50 {summary.get('p50_ms')} ms  p95 {summary.get('p95_ms')} ms"
+      f"  busy={summary['busy']} errors={summary['errors']}"
+    )
+  memory = results["memory"]
+  workers = memory["peak_rss_worker_mb"]
+  print(f"Peak RSS: {memory['peak_rss_mb']} MB" + (f" (largest worker process: {workers} MB)" if workers is not None else ""))
+  if results.get("cold_start"):
+    print(f"Cold start: {results['cold_start']}")
+
+def main_cli(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--images", default=DEFAULT_IMAGES, help="directory of sample face images")
+  parser.add_argument("--requests", type=int, default=20, help="sequential requests per endpoint")
+  parser.add_argument("--concurrency", default="1,2,4,8", help="comma-separated client counts")
+  parser.add_argument("--requests-per-client", type=int, default=10)
+  parser.add_argument("--warmup", type=int, default=3, help="rounds of untimed requests (one per worker, sent concurrently) before measuring")
+  parser.add_argument("--output", help="write results JSON here")
+  parser.add_argument("--baseline", help="compare against this results JSON")
+  parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression (0.2 = 20%%)")
+  parser.add_argument("--save-baseline", help="also write results to this baseline file")
+  parser.add_argument("--skip-cold-start", action="store_true")
+  parser.add_argument("--with-cache", action="store_true", help="leave the embedding cache enabled")
+  parser.add_argument("--cold-start-probe", help=argparse.SUPPRESS)
+  args = parser.parse_args(argv)
+
+  index_dir = _configure_environment(args.with_cache)
+  try:
+    if args.cold_start_probe:
+      return _cold_start_probe(args.cold_start_probe)
+    return _benchmark(args)
+  finally:
+    if index_dir is not None:
+      shutil.rmtree(index_dir, ignore_errors=True)
+
+def _benchmark(args):
+  images = _load_images(args.images)
+  if not images:
+    print(f"No images found in {args.images}")
+    return 2
+
+  import main
+
+  async def run():
+    await _warm_up(main.app, main.engine, images, args.warmup)
+    latency = await _bench_latency(main.app, images, args.requests)
+    throughput = []
+    for concurrency in (int(c) for c in args.concurrency.split(",") if c.strip()):
+      throughput.append(await _bench_throughput(main.app, images, concurrency, args.requests_per_client))
+    return latency, throughput
+
+  latency, throughput = asyncio.run(run())
+  # Wait for worker processes to exit so RUSAGE_CHILDREN covers exactly
+  # them, before the cold-start probe adds a child of its own
+  main.engine.shutdown(wait=True)
+  memory = {
+    "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+    "peak_rss_worker_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN) if main.FACE_WORKER_MODE == "process" else None
+  }
+
+  cold_start = None
+  if not args.skip_cold_start:
+    first_image = os.path.join(args.images, images[0][0])
+    cold_start = _cold_start(first_image, args.with_cache)
+
+  results = {
+    "meta": {
+      "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "cpu_count": os.cpu_count(),
+      "images": len(images),
+      "config": {
+        "workers": main.FACE_WORKERS,
+        "worker_mode": main.FACE_WORKER_MODE,
+        "queue_size": main.FACE_QUEUE_SIZE,
+        "pipeline": main.FACE_PIPELINE,
+        "batch_window_ms": main.FACE_BATCH_WINDOW_MS,
+        "cache_max_bytes": main.FACE_CACHE_MAX_BYTES
+      }
+    },
+    "latency": latency,
+    "throughput": throughput,
+    "memory": memory,
+    "cold_start": cold_start
+  }
+
+  _print_results(results)
+
+  for path in (args.output, args.save_baseline):
+    if path:
+      with open(path, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=2)
+
+  if args.baseline:
+    with open(args.baseline, "r", encoding="utf-8") as fh:
+      baseline = json.load(fh)
+    rows = _compare(results, baseline, args.threshold)
+    regressions = [row for row in rows if row[4]]
+    print(f"Baseline comparison ({args.baseline}, threshold {args.threshold:.0%}):")
+    for name, base, value, change, regressed in rows:
+      marker = "✗" if regressed else "✓"
+      print(f"  {marker} {name:<36} {base:>10} -> {value:>10}  ({change:+.1%})")
+    if regressions:
+      print(f"❌ {len(regressions)} metric(s) regressed")
+      return 1
+    print("✅ No regressions")
+
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main_cli())
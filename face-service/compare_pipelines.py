@@ -0,0 +1,290 @@
+"""
+Compare the two-stage and single-pass pipelines over a directory of faces.
+
+Reports per-image latency and CPU time for each pipeline, and whether
+their embeddings can be used interchangeably:
+
+- with labels (one sub-directory per person), the same-person and
+  different-person distance ranges of each pipeline, their margins to
+  MATCH_THRESHOLD and the false accepts / rejects at that threshold,
+  including mixed pairs (two-stage reference vs single-pass live image,
+  as happens when stored embeddings predate a pipeline switch);
+- for every image, the cross-pipeline error (distance between its
+  two-stage and single-pass embeddings) against the distance to its
+  nearest other image. A pipeline switch is only safe when that error is
+  small next to the gap between different people.
+
+Decision agreement alone proves little: when every pair sits far below
+the threshold, both pipelines "agree" whatever their embeddings are.
+
+Usage:
+  python compare_pipelines.py ../server/data/faces
+  python compare_pipelines.py ./people --repeat 5 --json results.json
+
+  people/alice/1.jpg, people/alice/2.jpg, people/bob/1.jpg, ...
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from itertools import combinations
+
+import cv2
+import numpy as np
+
+import main
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+def _load_images(directory):
+  """[(name, label, image)]; images in a sub-directory are labelled with its name"""
+  images = []
+  for entry in sorted(os.listdir(directory)):
+    path = os.path.join(directory, entry)
+    if os.path.isdir(path):
+      files = [(os.path.join(entry, name), entry, os.path.join(path, name)) for name in sorted(os.listdir(path))]
+    else:
+      files = [(entry, None, path)]
+    for name, label, file_path in files:
+      if not name.lower().endswith(IMAGE_EXTENSIONS):
+        continue
+      with open(file_path, "rb") as fh:
+        image = main._decode_image(fh.read())
+      if image is not None:
+        images.append((name, label, image))
+  return images
+
+def _run_pipeline(pipeline, images, repeat):
+  """Embed every image, returning ({name: embedding}, timing summary)"""
+  embeddings = {}
+  failures = {}
+  wall_ms = {}
+  cpu_ms = {}
+
+  # Warm up the models on every image so graph construction and first-run
+  # allocations are not timed
+  main._get_models()
+  for name, _, image in images:
+    try:
+      main._embedding_from_image(image, pipeline)
+    except ValueError:
+      pass
+
+  for name, _, image in images:
+    for _ in range(repeat):
+      wall_start = time.perf_counter()
+      cpu_start = time.process_time()
+      try:
+        embeddings[name] = main._embedding_from_image(image, pipeline)
+      except ValueError as exc:
+        failures[name] = str(exc)
+        break
+      finally:
+        wall_ms.setdefault(name, []).append((time.perf_counter() - wall_start) * 1000)
+        cpu_ms.setdefault(name, []).append((time.process_time() - cpu_start) * 1000)
+
+  # Median of the repeats per image, so one scheduler hiccup does not skew the mean
+  wall = [float(np.median(values)) for values in wall_ms.values()]
+  cpu = {name: float(np.median(values)) for name, values in cpu_ms.items()}
+  summary = {
+    "images": len(images),
+    "embedded": len(embeddings),
+    "failures": failures,
+    "wall_ms_p50": round(float(np.percentile(wall, 50)), 2) if wall else None,
+    "wall_ms_p95": round(float(np.percentile(wall, 95)), 2) if wall else None,
+    "cpu_ms_p50": round(float(np.median(list(cpu.values()))), 2) if cpu else None,
+    "cpu_ms_per_image": cpu
+  }
+  return embeddings, summary
+
+def _distance(a, b):
+  a = a / (np.linalg.norm(a) + 1e-8)
+  b = b / (np.linalg.norm(b) + 1e-8)
+  return float(1.0 - np.dot(a, b))
+
+def _range(values):
+  if not values:
+    return None
+  return {
+    "min": round(float(np.min(values)), 4),
+    "mean": round(float(np.mean(values)), 4),
+    "max": round(float(np.max(values)), 4),
+    "count": len(values)
+  }
+
+def _cpu_ratio(two_stage_summary, single_pass_summary):
+  """Median over images of single-pass CPU / two-stage CPU"""
+  two_stage = two_stage_summary["cpu_ms_per_image"]
+  single_pass = single_pass_summary["cpu_ms_per_image"]
+  ratios = [single_pass[name] / two_stage[name] for name in two_stage if name in single_pass and two_stage[name] > 0]
+  return round(float(np.median(ratios)), 3) if ratios else None
+
+def _compare_embeddings(two_stage, single_pass, labels):
+  """Distance ranges, threshold margins and cross-pipeline error"""
+  threshold = main.MATCH_THRESHOLD
+  names = sorted(set(two_stage) & set(single_pass))
+  labelled = all(labels[name] is not None for name in names) and len({labels[name] for name in names}) > 1
+
+  variants = {
+    "two-stage": lambda a, b: _distance(two_stage[a], two_stage[b]),
+    "single-pass": lambda a, b: _distance(single_pass[a], single_pass[b]),
+    "mixed": lambda a, b: _distance(two_stage[a], single_pass[b])
+  }
+  pairs = []
+  for a, b in combinations(names, 2):
+    pair = {"a": a, "b": b, "same_person": labels[a] == labels[b] if labelled else None}
+    for variant, distance in variants.items():
+      pair[variant] = round(distance(a, b), 4)
+    pairs.append(pair)
+
+  report = {"labelled": labelled, "pairs": len(pairs), "pipelines": {}}
+  for variant in variants:
+    verified = [p[variant] < threshold for p in pairs]
+    entry = {
+      "agreement_with_two_stage": round(
+        sum(v == (p["two-stage"] < threshold) for v, p in zip(verified, pairs)) / len(pairs), 4
+      ) if pairs else None
+    }
+    if labelled:
+      same = [p[variant] for p in pairs if p["same_person"]]
+      different = [p[variant] for p in pairs if not p["same_person"]]
+      entry.update({
+        "same_person": _range(same),
+        "different_person": _range(different),
+        # Positive margins mean every pair lands on the right side of the threshold
+        "same_person_margin": round(threshold - max(same), 4) if same else None,
+        "different_person_margin": round(min(different) - threshold, 4) if different else None,
+        "false_rejects": sum(1 for d in same if d >= threshold),
+        "false_accepts": sum(1 for d in different if d < threshold)
+      })
+    else:
+      distances = [p[variant] for p in pairs]
+      entry.update({
+        "all_pairs": _range(distances),
+        "margin": round(threshold - max(distances), 4) if distances else None
+      })
+    report["pipelines"][variant] = entry
+
+  # Cross-pipeline error per image against the nearest other image (two-stage)
+  cross = {}
+  for name in names:
+    others = [
+      _distance(two_stage[name], two_stage[other]) for other in names
+      if other != name and (not labelled or labels[other] != labels[name])
+    ]
+    cross[name] = {
+      "cross_pipeline": round(_distance(two_stage[name], single_pass[name]), 4),
+      "nearest_other": round(min(others), 4) if others else None
+    }
+  errors = [c["cross_pipeline"] for c in cross.values()]
+  neighbours = [c["nearest_other"] for c in cross.values() if c["nearest_other"] is not None]
+  report["cross_pipeline"] = {
+    "error": _range(errors),
+    # nearest different person when labelled, nearest other image otherwise
+    "nearest_other": _range(neighbours),
+    "exceeds_nearest_other": sum(
+      1 for c in cross.values() if c["nearest_other"] is not None and c["cross_pipeline"] >= c["nearest_other"]
+    ),
+    "per_image": cross
+  }
+  # Interchangeable only if switching pipeline moves an embedding less than
+  # the gap to the closest different person; unknown without labels
+  report["compatible"] = (
+    report["cross_pipeline"]["exceeds_nearest_other"] == 0
+    and report["pipelines"]["mixed"]["false_accepts"] == 0
+    and report["pipelines"]["mixed"]["false_rejects"] == report["pipelines"]["two-stage"]["false_rejects"]
+  ) if labelled else None
+  report["pair_distances"] = pairs
+  return report
+
+def _print_range(label, values):
+  if values:
+    print(f"    {label:<18} {values['min']:.4f} .. {values['max']:.4f}  (mean {values['mean']:.4f}, n={values['count']})")
+
+def main_cli(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("directory", help="directory of face images, optionally one sub-directory per person")
+  parser.add_argument("--repeat", type=int, default=3, help="timed runs per image (the median is used)")
+  parser.add_argument("--json", dest="json_path", help="write full results to this file")
+  parser.add_argument("--min-agreement", type=float, default=1.0,
+                      help="exit non-zero if decision agreement with two-stage falls below this")
+  args = parser.parse_args(argv)
+
+  cv2.setNumThreads(1)
+  images = _load_images(args.directory)
+  if not images:
+    print(f"No images found in {args.directory}")
+    return 2
+  labels = {name: label for name, label, _ in images}
+
+  two_stage, two_stage_summary = _run_pipeline("two-stage", images, args.repeat)
+  single_pass, single_pass_summary = _run_pipeline("single-pass", images, args.repeat)
+  report = _compare_embeddings(two_stage, single_pass, labels)
+  cpu_ratio = _cpu_ratio(two_stage_summary, single_pass_summary)
+
+  results = {
+    "directory": os.path.abspath(args.directory),
+    "threshold": main.MATCH_THRESHOLD,
+    "single_pass_side": main.FACE_SINGLE_PASS_SIDE,
+    "repeat": args.repeat,
+    "two-stage": two_stage_summary,
+    "single-pass": single_pass_summary,
+    "single_pass_cpu_ratio": cpu_ratio,
+    "comparison": report
+  }
+
+  people = len({label for label in labels.values() if label is not None})
+  print(
+    f"Images: {len(images)}  pairs: {report['pairs']}  threshold: {main.MATCH_THRESHOLD}  "
+    + (f"people: {people}" if report["labelled"] else "unlabelled")
+  )
+  for pipeline, summary in (("two-stage", two_stage_summary), ("single-pass", single_pass_summary)):
+    print(
+      f"  {pipeline:<12} embedded {summary['embedded']}/{summary['images']}"
+      f"  wall p50 {summary['wall_ms_p50']} ms  p95 {summary['wall_ms_p95']} ms"
+      f"  cpu p50 {summary['cpu_ms_p50']} ms"
+    )
+  if cpu_ratio is not None:
+    print(f"  single-pass CPU is {cpu_ratio:.0%} of two-stage (median per image)")
+
+  for variant, entry in report["pipelines"].items():
+    agreement = "" if variant == "two-stage" else f": decision agreement with two-stage {entry['agreement_with_two_stage']}"
+    print(f"  {variant}{agreement}")
+    if report["labelled"]:
+      _print_range("same person", entry["same_person"])
+      _print_range("different person", entry["different_person"])
+      print(
+        f"    margins to threshold: same {entry['same_person_margin']}  different {entry['different_person_margin']}"
+        f"  false rejects {entry['false_rejects']}  false accepts {entry['false_accepts']}"
+      )
+    else:
+      _print_range("all pairs", entry["all_pairs"])
+      print(f"    margin to threshold {entry['margin']}")
+
+  cross = report["cross_pipeline"]
+  print("  same image, two-stage vs single-pass")
+  _print_range("cross-pipeline", cross["error"])
+  _print_range("nearest different" if report["labelled"] else "nearest other", cross["nearest_other"])
+  print(f"    cross-pipeline error >= nearest {'different person' if report['labelled'] else 'other image'} "
+        f"for {cross['exceeds_nearest_other']}/{len(cross['per_image'])} images")
+  if report["labelled"]:
+    print(f"  embeddings interchangeable: {'yes' if report['compatible'] else 'NO'}")
+  else:
+    print("  no labels: decisions cannot be checked against identity; "
+          "put each person's images in their own sub-directory")
+
+  if args.json_path:
+    with open(args.json_path, "w", encoding="utf-8") as fh:
+      json.dump(results, fh, indent=2)
+
+  agreements = [entry["agreement_with_two_stage"] for entry in report["pipelines"].values()]
+  if report["compatible"] is False:
+    return 1
+  if agreements[0] is not None and min(agreements) < args.min_agreement:
+    return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main_cli())
@@ -1,19 +1,93 @@
 """
 Face Verification Service - Ultra-lightweight using MediaPipe
-Memory footprint: ~50MB (pure Python, no compilation needed)
-Build time: <10s
+Pure Python, no compilation needed.
+Measured latency, throughput, memory and cold start: see benchmark.py
 """
 
 import os
+import time
+import json
+import hashlib
+import base64
+import struct
+import random
+import asyncio
+import contextvars
+import threading
+import multiprocessing
+from typing import List, Union
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import cv2
 import numpy as np
-from fastapi import FastAPI, File, UploadFile, HTTPException, Body
+from fastapi import FastAPI, File, Form, Query, UploadFile, HTTPException, Body, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, PlainTextResponse
+from starlette.routing import Match
 import mediapipe as mp
-import tempfile
+
+# Inference engine configuration
+FACE_WORKERS = max(1, int(os.environ.get("FACE_WORKERS", "1")))
+FACE_WORKER_MODE = os.environ.get("FACE_WORKER_MODE", "thread").lower()  # thread | process
+FACE_QUEUE_SIZE = max(0, int(os.environ.get("FACE_QUEUE_SIZE", "16")))
+FACE_RETRY_AFTER = max(1, int(os.environ.get("FACE_RETRY_AFTER", "1")))
+
+# Image ingestion configuration
+FACE_MAX_UPLOAD_BYTES = int(os.environ.get("FACE_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+FACE_DECODE_REDUCE = int(os.environ.get("FACE_DECODE_REDUCE", "1"))  # 1, 2, 4 or 8
+FACE_MAX_IMAGE_SIDE = int(os.environ.get("FACE_MAX_IMAGE_SIDE", "0"))  # 0 = no resize
+
+# Micro-batching configuration
+FACE_BATCH_WINDOW_MS = max(0.0, float(os.environ.get("FACE_BATCH_WINDOW_MS", "0")))  # 0 = off
+FACE_BATCH_MAX = max(1, int(os.environ.get("FACE_BATCH_MAX", "8")))
+FACE_BATCH_MAX_IMAGES = max(1, int(os.environ.get("FACE_BATCH_MAX_IMAGES", "32")))
+
+# Pipeline: "two-stage" runs FaceDetection then FaceMesh on the crop,
+# "single-pass" runs FaceMesh once on a downscaled full frame
+FACE_PIPELINE = os.environ.get("FACE_PIPELINE", "two-stage").lower()
+FACE_SINGLE_PASS_SIDE = max(0, int(os.environ.get("FACE_SINGLE_PASS_SIDE", "640")))  # 0 = no resize
+PIPELINES = ("two-stage", "single-pass")
+
+if FACE_PIPELINE not in PIPELINES:
+  raise ValueError(f"FACE_PIPELINE must be one of {PIPELINES}")
+
+# Streaming verification configuration
+FACE_STREAM_MAX_SESSIONS = max(1, int(os.environ.get("FACE_STREAM_MAX_SESSIONS", "4")))
+FACE_STREAM_IDLE_TIMEOUT = max(1.0, float(os.environ.get("FACE_STREAM_IDLE_TIMEOUT", "10")))  # seconds
+FACE_STREAM_REQUIRED_MATCHES = max(1, int(os.environ.get("FACE_STREAM_REQUIRED_MATCHES", "3")))
+FACE_STREAM_MAX_FRAMES = max(1, int(os.environ.get("FACE_STREAM_MAX_FRAMES", "30")))
+
+# Embedding cache configuration
+FACE_CACHE_MAX_BYTES = max(0, int(os.environ.get("FACE_CACHE_MAX_BYTES", str(32 * 1024 * 1024))))  # 0 = off
+FACE_CACHE_TTL = max(0.0, float(os.environ.get("FACE_CACHE_TTL", "0")))  # seconds, 0 = no expiry
+
+# Enrollment index configuration
+FACE_INDEX_DIR = os.environ.get("FACE_INDEX_DIR", "data/index")
+# Off until calibrated: landmark embeddings of one person sit far below
+# MATCH_THRESHOLD, so a guessed cutoff blocks unrelated enrollments
+FACE_DUPLICATE_THRESHOLD = max(0.0, float(os.environ.get("FACE_DUPLICATE_THRESHOLD", "0")))  # 0 = off
+
+# Observability configuration
+FACE_SLOW_REQUEST_MS = max(0.0, float(os.environ.get("FACE_SLOW_REQUEST_MS", "0")))  # 0 = off
+FACE_SLOW_SAMPLE_RATE = min(1.0, max(0.0, float(os.environ.get("FACE_SLOW_SAMPLE_RATE", "1.0"))))
+
+# 468 landmarks × 3 coordinates
+EMBEDDING_SIZE = 468 * 3
+
+# Cosine distance below which two embeddings are the same person
+MATCH_THRESHOLD = 0.1
+
+@asynccontextmanager
+async def lifespan(app):
+  """Stop the inference and streaming worker pools on shutdown"""
+  yield
+  engine.shutdown()
+  _shutdown_streams()
 
 # Initialize FastAPI
-app = FastAPI(title="Face Verification Service v5.0", version="5.0.0")
+app = FastAPI(title="Face Verification Service v5.0", version="5.0.0", lifespan=lifespan)
 
 # CORS configuration
 app.add_middleware(
@@ -24,31 +98,406 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Latency buckets in seconds, from 1 ms up to the server's 30 s axios timeout
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+  """Fixed-bucket histogram (counts are stored per bucket, not cumulative)"""
+
+  def __init__(self, buckets=LATENCY_BUCKETS):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value):
+    self.sum += value
+    self.count += 1
+    for i, bound in enumerate(self.buckets):
+      if value <= bound:
+        self.counts[i] += 1
+        return
+    self.counts[-1] += 1
+
+class MetricsRegistry:
+  """Minimal Prometheus text-format registry.
+
+  Counters and histograms are updated from the event loop; callback
+  metrics read live values (queue depth, cache size) at scrape time.
+  """
+
+  def __init__(self):
+    self._families = {}
+    self._values = {}
+    self._callbacks = {}
+
+  def describe(self, name, kind, help_text):
+    self._families[name] = (kind, help_text)
+    self._values.setdefault(name, {})
+
+  def callback(self, name, kind, help_text, fn):
+    self._families[name] = (kind, help_text)
+    self._callbacks[name] = fn
+
+  @staticmethod
+  def _key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+  def inc(self, name, labels=None, value=1):
+    values = self._values[name]
+    key = self._key(labels)
+    values[key] = values.get(key, 0) + value
+
+  def observe(self, name, value, labels=None):
+    values = self._values[name]
+    key = self._key(labels)
+    histogram = values.get(key)
+    if histogram is None:
+      histogram = values[key] = Histogram()
+    histogram.observe(value)
+
+  @staticmethod
+  def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+      return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+  def render(self):
+    lines = []
+    for name, (kind, help_text) in self._families.items():
+      lines.append(f"# HELP {name} {help_text}")
+      lines.append(f"# TYPE {name} {kind}")
+      if name in self._callbacks:
+        lines.append(f"{name} {self._callbacks[name]()}")
+        continue
+      for key, value in self._values[name].items():
+        if kind != "histogram":
+          lines.append(f"{name}{self._format_labels(key)} {value}")
+          continue
+        cumulative = 0
+        for bound, count in zip(value.buckets, value.counts):
+          cumulative += count
+          lines.append(f"{name}_bucket{self._format_labels(key, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{self._format_labels(key, [('le', '+Inf')])} {value.count}")
+        lines.append(f"{name}_sum{self._format_labels(key)} {value.sum}")
+        lines.append(f"{name}_count{self._format_labels(key)} {value.count}")
+    return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+metrics.describe("face_requests_total", "counter", "HTTP requests by endpoint and outcome")
+metrics.describe("face_request_duration_seconds", "histogram", "HTTP request latency by endpoint")
+metrics.describe("face_stage_duration_seconds", "histogram", "Pipeline stage latency")
+
+class RequestTrace:
+  """Per-request stage timings and outcome, shared via a ContextVar"""
+
+  __slots__ = ("timings", "outcome")
+
+  def __init__(self):
+    self.timings = {}
+    self.outcome = None
+
+  def add(self, stage, seconds):
+    self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+_current_trace = contextvars.ContextVar("face_request_trace", default=None)
+
+# Set while a worker job runs, so stages are shipped back with the result
+_worker_stage_log = threading.local()
+
+def _record_stage(stage, seconds):
+  """Observe a stage duration and attribute it to the current request"""
+  metrics.observe("face_stage_duration_seconds", seconds, {"stage": stage})
+  trace = _current_trace.get()
+  if trace is not None:
+    trace.add(stage, seconds)
+
+def _mark_outcome(outcome):
+  trace = _current_trace.get()
+  if trace is not None:
+    trace.outcome = outcome
+
+@contextmanager
+def _stage(name):
+  """Time a pipeline stage, in a worker job or on the event loop"""
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    elapsed = time.perf_counter() - start
+    log = getattr(_worker_stage_log, "log", None)
+    if log is not None:
+      log.append((name, elapsed))
+    else:
+      _record_stage(name, elapsed)
+
+def _timed_call(fn, *args):
+  """Worker wrapper: run fn, returning (ok, value, stage log, start time)"""
+  started = time.monotonic()
+  _worker_stage_log.log = []
+  try:
+    value = fn(*args)
+    ok = True
+  except Exception as exc:
+    value = exc
+    ok = False
+  finally:
+    log = _worker_stage_log.log
+    _worker_stage_log.log = None
+  return ok, value, log, started
+
 # MediaPipe Face Detection
 mp_face_detection = mp.solutions.face_detection
 mp_face_mesh = mp.solutions.face_mesh
-face_detection = mp_face_detection.FaceDetection(
-    model_selection=1,  # 1 = full range
-    min_detection_confidence=0.5
-)
-face_mesh = mp_face_mesh.FaceMesh(
-    static_image_mode=True,
-    max_num_faces=1,
-    min_detection_confidence=0.5
+
+# MediaPipe graphs are not safe to share between threads, so every worker
+# (thread or process) lazily builds its own FaceDetection/FaceMesh pair.
+_worker_models = threading.local()
+
+def _get_models():
+  """Return this worker's (face_detection, face_mesh) instances"""
+  models = getattr(_worker_models, "models", None)
+  if models is None:
+    face_detection = mp_face_detection.FaceDetection(
+        model_selection=1,  # 1 = full range
+        min_detection_confidence=0.5
+    )
+    face_mesh = mp_face_mesh.FaceMesh(
+        static_image_mode=True,
+        max_num_faces=1,
+        min_detection_confidence=0.5
+    )
+    models = (face_detection, face_mesh)
+    _worker_models.models = models
+  return models
+
+class QueueFullError(Exception):
+  """Raised when the inference queue cannot accept more work"""
+
+class InferenceEngine:
+  """Bounded pool of MediaPipe workers kept off the event loop"""
+
+  def __init__(self, workers=1, mode="thread", queue_size=16):
+    if mode not in ("thread", "process"):
+      raise ValueError(f"Unknown worker mode: {mode}")
+    self.workers = workers
+    self.mode = mode
+    self.queue_size = queue_size
+    self.pending = 0
+    self._executor = None
+
+  @property
+  def capacity(self):
+    """Jobs allowed in flight: one per worker plus the waiting queue"""
+    return self.workers + self.queue_size
+
+  @property
+  def in_flight(self):
+    return min(self.pending, self.workers)
+
+  @property
+  def queued(self):
+    return max(0, self.pending - self.workers)
+
+  def _get_executor(self):
+    if self._executor is None:
+      if self.mode == "process":
+        self._executor = ProcessPoolExecutor(
+          max_workers=self.workers,
+          mp_context=multiprocessing.get_context("spawn")
+        )
+      else:
+        self._executor = ThreadPoolExecutor(
+          max_workers=self.workers,
+          thread_name_prefix="face-worker"
+        )
+    return self._executor
+
+  async def run(self, fn, *args):
+    """Run fn(*args) on a worker, or raise QueueFullError when saturated"""
+    if self.pending >= self.capacity:
+      raise QueueFullError("Face service is busy")
+    self.pending += 1
+    submitted = time.monotonic()
+    executor = self._get_executor()
+    try:
+      loop = asyncio.get_running_loop()
+      ok, value, log, started = await loop.run_in_executor(
+        executor, _timed_call, fn, *args
+      )
+    except BrokenProcessPool:
+      # A worker process died (segfault, OOM kill); the pool refuses all
+      # further work, so replace it and let the client retry
+      self._reset_executor(executor)
+      raise QueueFullError("Face worker crashed, restarting")
+    finally:
+      self.pending -= 1
+
+    _record_stage("queue_wait", max(0.0, started - submitted))
+    for stage, seconds in log:
+      _record_stage(stage, seconds)
+    if not ok:
+      raise value
+    return value
+
+  def _reset_executor(self, executor):
+    # Every job on a broken pool fails at once; only the first one resets it
+    if self._executor is executor:
+      self._executor = None
+      executor.shutdown(wait=False, cancel_futures=True)
+
+  def status(self):
+    return {
+      "workers": self.workers,
+      "mode": self.mode,
+      "queue_size": self.queue_size,
+      "in_flight": self.in_flight,
+      "queued": self.queued
+    }
+
+  def shutdown(self, wait=False):
+    if self._executor is not None:
+      self._executor.shutdown(wait=wait, cancel_futures=True)
+      self._executor = None
+
+engine = InferenceEngine(
+  workers=FACE_WORKERS,
+  mode=FACE_WORKER_MODE,
+  queue_size=FACE_QUEUE_SIZE
 )
 
-def _save_upload(upload_file: UploadFile) -> str:
-  """Save uploaded file to temporary location"""
-  with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-    tmp.write(upload_file.file.read())
-    return tmp.name
+def _busy_error():
+  """503 response telling clients when to retry"""
+  return HTTPException(
+    status_code=503,
+    detail="Face service is busy, please retry",
+    headers={"Retry-After": str(FACE_RETRY_AFTER)}
+  )
+
+class NoFaceError(ValueError):
+  """Raised when no face can be found in an image"""
+
+class InvalidImageError(ValueError):
+  """Raised when upload bytes cannot be decoded as an image"""
+
+# JPEG decoders can skip work by decoding straight to 1/2, 1/4 or 1/8 scale
+_DECODE_FLAGS = {
+  1: cv2.IMREAD_COLOR,
+  2: cv2.IMREAD_REDUCED_COLOR_2,
+  4: cv2.IMREAD_REDUCED_COLOR_4,
+  8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+if FACE_DECODE_REDUCE not in _DECODE_FLAGS:
+  raise ValueError(f"FACE_DECODE_REDUCE must be one of {sorted(_DECODE_FLAGS)}")
+
+# Room for multipart boundaries, part headers and small form fields
+_MULTIPART_OVERHEAD = 64 * 1024
+
+# Image parts accepted per request, for endpoints that take more than one
+_UPLOAD_PARTS = {
+  "/verify-face": 2,
+  "/get-embeddings-batch": FACE_BATCH_MAX_IMAGES
+}
+
+def _body_limit(scope):
+  return _UPLOAD_PARTS.get(_route_path(scope), 1) * FACE_MAX_UPLOAD_BYTES + _MULTIPART_OVERHEAD
+
+def _too_large_error(limit):
+  return HTTPException(status_code=413, detail=f"Request body too large (max {limit} bytes)")
+
+class BodySizeLimitMiddleware:
+  """Reject oversized request bodies before the multipart parser sees them.
+
+  Starlette spools every upload part larger than 1 MB to a temporary file
+  while parsing the form, so the per-image check in _read_upload alone
+  would only run after the whole body had been written to disk. Requests
+  that declare a Content-Length over the limit are refused up front;
+  chunked bodies are counted as they stream in.
+  """
+
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+
+    limit = _body_limit(scope)
+    content_length = dict(scope["headers"]).get(b"content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+      error = _too_large_error(limit)
+      response = Response(
+        json.dumps({"detail": error.detail}),
+        status_code=error.status_code,
+        media_type="application/json"
+      )
+      await response(scope, receive, send)
+      return
+
+    received = 0
+
+    async def limited_receive():
+      nonlocal received
+      message = await receive()
+      if message["type"] == "http.request":
+        received += len(message.get("body", b""))
+        if received > limit:
+          raise _too_large_error(limit)
+      return message
+
+    await self.app(scope, limited_receive, send)
+
+app.add_middleware(BodySizeLimitMiddleware)
+
+async def _read_upload(upload_file: UploadFile) -> bytes:
+  """Read an upload into memory, enforcing the per-image size cap.
+
+  Parts over 1 MB arrive via Starlette's on-disk spool file, which
+  BodySizeLimitMiddleware keeps bounded.
+  """
+  with _stage("upload_read"):
+    data = await upload_file.read(FACE_MAX_UPLOAD_BYTES + 1)
+  if len(data) > FACE_MAX_UPLOAD_BYTES:
+    raise HTTPException(
+      status_code=413,
+      detail=f"Image too large (max {FACE_MAX_UPLOAD_BYTES} bytes)"
+    )
+  return data
+
+def _decode_image(data: bytes):
+  """Decode image bytes in memory, optionally at reduced resolution"""
+  buffer = np.frombuffer(data, dtype=np.uint8)
+  if buffer.size == 0:
+    return None
+
+  with _stage("decode"):
+    image = cv2.imdecode(buffer, _DECODE_FLAGS[FACE_DECODE_REDUCE])
+    if image is None:
+      return None
+
+    # Cap the longest side; the face crop is resized to 256x256 anyway
+    h, w = image.shape[:2]
+    if FACE_MAX_IMAGE_SIDE > 0 and max(h, w) > FACE_MAX_IMAGE_SIDE:
+      scale = FACE_MAX_IMAGE_SIDE / max(h, w)
+      image = cv2.resize(
+        image,
+        (max(1, int(w * scale)), max(1, int(h * scale))),
+        interpolation=cv2.INTER_AREA
+      )
+
+  return image
 
 def _extract_face_region(image):
   """Extract and normalize face region using MediaPipe detection"""
   h, w, _ = image.shape
   
   # Detect face
-  results = face_detection.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+  face_detection, _ = _get_models()
+  with _stage("detection"):
+    results = face_detection.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
   
   if not results.detections:
     return None
@@ -77,7 +526,8 @@ def _extract_face_region(image):
     return None
   
   # Normalize to 256x256
-  face_normalized = cv2.resize(face_region, (256, 256), interpolation=cv2.INTER_AREA)
+  with _stage("crop_resize"):
+    face_normalized = cv2.resize(face_region, (256, 256), interpolation=cv2.INTER_AREA)
   
   return face_normalized
 
@@ -87,25 +537,684 @@ def _face_region_to_embedding(face_region):
     raise ValueError("No face region")
   
   # Get face landmarks
-  rgb_image = cv2.cvtColor(face_region, cv2.COLOR_BGR2RGB)
-  results = face_mesh.process(rgb_image)
+  _, face_mesh = _get_models()
+  with _stage("mesh"):
+    rgb_image = cv2.cvtColor(face_region, cv2.COLOR_BGR2RGB)
+    results = face_mesh.process(rgb_image)
   
   if not results.multi_face_landmarks or len(results.multi_face_landmarks) == 0:
-    raise ValueError("No face landmarks detected")
+    raise NoFaceError("No face landmarks detected")
   
   # Get landmarks (468 points, 3D coordinates)
   landmarks = results.multi_face_landmarks[0].landmark
   
-  # Convert to embedding: flatten landmark coordinates
-  embedding = []
-  for lm in landmarks:
-    embedding.extend([lm.x, lm.y, lm.z])
-  
-  # Normalize embedding
-  embedding = np.array(embedding, dtype=np.float32)
-  embedding = embedding / (np.linalg.norm(embedding) + 1e-8)
+  with _stage("embedding"):
+    # Convert to embedding: flatten landmark coordinates straight into float32
+    embedding = _landmark_array(landmarks).reshape(-1)
+    
+    # Normalize embedding
+    embedding /= np.linalg.norm(embedding) + 1e-8
   
-  return embedding.tolist()
+  return embedding
+
+def _landmark_array(landmarks):
+  """MediaPipe landmarks as an (N, 3) float32 array"""
+  return np.fromiter(
+    (value for lm in landmarks for value in (lm.x, lm.y, lm.z)),
+    dtype=np.float32,
+    count=len(landmarks) * 3
+  ).reshape(-1, 3)
+
+def _single_pass_embedding(image, face_mesh=None):
+  """Embedding from one FaceMesh pass over the (downscaled) full frame.
+
+  The face box is taken from the landmark extents with the same padding
+  as _extract_face_region, and landmarks are re-expressed relative to
+  that box. This approximates the two-stage crop but does not reproduce
+  it, so embeddings from the two pipelines should not be compared
+  (compare_pipelines.py measures the gap).
+  A tracking-mode FaceMesh may be passed in for video streams.
+  """
+  h, w, _ = image.shape
+  frame = image
+  if FACE_SINGLE_PASS_SIDE > 0 and max(h, w) > FACE_SINGLE_PASS_SIDE:
+    scale = FACE_SINGLE_PASS_SIDE / max(h, w)
+    with _stage("crop_resize"):
+      frame = cv2.resize(
+        image,
+        (max(1, int(w * scale)), max(1, int(h * scale))),
+        interpolation=cv2.INTER_AREA
+      )
+
+  if face_mesh is None:
+    _, face_mesh = _get_models()
+  with _stage("mesh"):
+    results = face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+  if not results.multi_face_landmarks:
+    raise NoFaceError("No face detected in image")
+
+  with _stage("embedding"):
+    # Landmarks are relative to the frame, so they map onto the original size
+    points = _landmark_array(results.multi_face_landmarks[0].landmark)
+    px = points[:, 0] * w
+    py = points[:, 1] * h
+
+    # Face box from landmark extents, padded and clipped like the detector box
+    x = int(px.min())
+    y = int(py.min())
+    width = int(px.max()) - x
+    height = int(py.max()) - y
+    padding = int(0.1 * max(width, height))
+    x = max(0, x - padding)
+    y = max(0, y - padding)
+    width = min(w - x, width + 2 * padding)
+    height = min(h - y, height + 2 * padding)
+    if width <= 0 or height <= 0:
+      raise NoFaceError("No face detected in image")
+
+    # Re-express landmarks relative to the crop (z scales with width)
+    embedding = np.empty_like(points)
+    embedding[:, 0] = (px - x) / width
+    embedding[:, 1] = (py - y) / height
+    embedding[:, 2] = points[:, 2] * (w / width)
+    embedding = embedding.reshape(-1)
+    embedding /= np.linalg.norm(embedding) + 1e-8
+
+  return embedding
+
+# Compact embedding encoding: a 6-byte header (magic, version, dtype,
+# dimension) followed by little-endian values. Sent as base64 in JSON or
+# as a raw application/octet-stream body.
+EMBEDDING_MAGIC = b"FE"
+EMBEDDING_FORMAT_VERSION = 2
+# magic, version, dtype, pipeline, padding (keeps float32 payloads aligned), dimension
+_EMBEDDING_HEADER = struct.Struct("<2sBBBxH")
+# Version 1 had no pipeline byte
+_EMBEDDING_HEADER_V1 = struct.Struct("<2sBBH")
+# 0 = unknown; embeddings from different pipelines must not be compared
+_PIPELINE_CODES = {"two-stage": 1, "single-pass": 2}
+_PIPELINE_NAMES = {code: name for name, code in _PIPELINE_CODES.items()}
+_EMBEDDING_DTYPES = {
+  "f32": (1, np.dtype("<f4")),
+  "f16": (2, np.dtype("<f2"))
+}
+_EMBEDDING_DTYPE_CODES = {code: (name, dtype) for name, (code, dtype) in _EMBEDDING_DTYPES.items()}
+EMBEDDING_ENCODINGS = ("json", "f32", "f16", "binary")
+
+def _pack_embedding(embedding, dtype="f32", pipeline=FACE_PIPELINE) -> bytes:
+  """Serialize an embedding with its version/dtype/pipeline/dimension header"""
+  code, np_dtype = _EMBEDDING_DTYPES[dtype]
+  values = np.asarray(embedding, dtype=np_dtype).reshape(-1)
+  header = _EMBEDDING_HEADER.pack(
+    EMBEDDING_MAGIC, EMBEDDING_FORMAT_VERSION, code, _PIPELINE_CODES.get(pipeline, 0), values.shape[0]
+  )
+  return header + values.tobytes()
+
+def _unpack_embedding(data: bytes):
+  """Parse a packed embedding, validating its header.
+
+  Returns (float32 vector, pipeline); the pipeline is None for version 1
+  headers, which did not record it.
+  """
+  if len(data) < _EMBEDDING_HEADER_V1.size:
+    raise ValueError("Encoded embedding is too short")
+  magic, version = struct.unpack_from("<2sB", data)
+  if magic != EMBEDDING_MAGIC:
+    raise ValueError("Encoded embedding has an invalid header")
+  if version == 1:
+    _, _, code, dim = _EMBEDDING_HEADER_V1.unpack_from(data)
+    pipeline_code = 0
+    header_size = _EMBEDDING_HEADER_V1.size
+  elif version == EMBEDDING_FORMAT_VERSION:
+    if len(data) < _EMBEDDING_HEADER.size:
+      raise ValueError("Encoded embedding is too short")
+    _, _, code, pipeline_code, dim = _EMBEDDING_HEADER.unpack_from(data)
+    header_size = _EMBEDDING_HEADER.size
+  else:
+    raise ValueError(f"Unsupported embedding format version {version}")
+  if code not in _EMBEDDING_DTYPE_CODES:
+    raise ValueError(f"Unsupported embedding dtype code {code}")
+  if pipeline_code and pipeline_code not in _PIPELINE_NAMES:
+    raise ValueError(f"Unsupported embedding pipeline code {pipeline_code}")
+  _, np_dtype = _EMBEDDING_DTYPE_CODES[code]
+  payload = data[header_size:]
+  if len(payload) != dim * np_dtype.itemsize:
+    raise ValueError(f"Encoded embedding length does not match dimension {dim}")
+  return np.frombuffer(payload, dtype=np_dtype).astype(np.float32), _PIPELINE_NAMES.get(pipeline_code)
+
+def _encode_embedding(embedding, encoding="json"):
+  """Embedding as a JSON list or a base64 packed string"""
+  with _stage("serialization"):
+    if encoding == "json":
+      return np.asarray(embedding, dtype=np.float32).tolist()
+    return base64.b64encode(_pack_embedding(embedding, encoding)).decode("ascii")
+
+def _decode_embedding(value):
+  """Accept a JSON list or a base64 packed string from a request body.
+
+  Returns (vector, pipeline); JSON lists carry no pipeline (None).
+  """
+  if isinstance(value, str):
+    try:
+      data = base64.b64decode(value, validate=True)
+    except ValueError:
+      raise ValueError("Encoded embedding is not valid base64")
+    return _unpack_embedding(data)
+  return np.asarray(value, dtype=np.float32), None
+
+def _check_pipelines(pipeline_a, pipeline_b):
+  """Refuse to compare embeddings known to come from different pipelines"""
+  if pipeline_a and pipeline_b and pipeline_a != pipeline_b:
+    raise ValueError(f"Embeddings come from different pipelines ({pipeline_a} vs {pipeline_b})")
+
+def _check_encoding(encoding, allowed=EMBEDDING_ENCODINGS):
+  if encoding not in allowed:
+    raise HTTPException(
+      status_code=400,
+      detail=f"Unsupported encoding '{encoding}' (use one of: {', '.join(allowed)})"
+    )
+
+def _prepare_image(image_data, pipeline=FACE_PIPELINE):
+  """First stage: crop the detected face (two-stage) or pass the frame through"""
+  if pipeline == "single-pass":
+    return image_data
+
+  face_region = _extract_face_region(image_data)
+  if face_region is None:
+    raise NoFaceError("No face detected in image")
+  return face_region
+
+def _embed_prepared(prepared, pipeline=FACE_PIPELINE):
+  """Second stage: landmarks and embedding"""
+  if pipeline == "single-pass":
+    return _single_pass_embedding(prepared)
+  return _face_region_to_embedding(prepared)
+
+def _embedding_from_image(image_data, pipeline=FACE_PIPELINE):
+  """Embedding for a decoded BGR image using the selected pipeline"""
+  return _embed_prepared(_prepare_image(image_data, pipeline), pipeline)
+
+def _embedding_from_bytes(data):
+  """Worker job: decode image bytes and return their embedding"""
+  image_data = _decode_image(data)
+  if image_data is None:
+    raise InvalidImageError("Invalid image format")
+
+  return _embedding_from_image(image_data)
+
+def _embeddings_from_batch(items):
+  """Worker job: embed a list of image bytes, stage by stage.
+
+  Returns one entry per item: the embedding, or the exception that
+  item raised, so one bad image does not fail the rest of the batch.
+  """
+  # Stage 1: decode and face detection
+  prepared = []
+  for data in items:
+    try:
+      image_data = _decode_image(data)
+      if image_data is None:
+        raise InvalidImageError("Invalid image format")
+      prepared.append(_prepare_image(image_data))
+    except Exception as exc:
+      prepared.append(exc)
+
+  # Stage 2: landmarks and embedding
+  results = []
+  for item in prepared:
+    if isinstance(item, Exception):
+      results.append(item)
+      continue
+    try:
+      results.append(_embed_prepared(item))
+    except Exception as exc:
+      results.append(exc)
+
+  return results
+
+def _split_batch(items, workers, max_size):
+  """Chunks sized so a batch spreads over every worker.
+
+  MediaPipe has no batched inference: a job embeds its images one after
+  another, so one big job would leave the other workers idle.
+  """
+  size = min(max_size, max(1, -(-len(items) // workers)))
+  return [items[i:i + size] for i in range(0, len(items), size)]
+
+class MicroBatcher:
+  """Coalesce concurrent single-image requests into per-worker jobs"""
+
+  def __init__(self, engine, window_ms=0.0, max_batch=8):
+    self.engine = engine
+    self.window = window_ms / 1000.0
+    self.max_batch = max_batch
+    self._pending = []
+    self._timer = None
+    self._tasks = set()
+
+  async def submit(self, data):
+    """Return the embedding for data, raising that image's own error"""
+    if self.window <= 0:
+      return await self.engine.run(_embedding_from_bytes, data)
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    self._pending.append((data, future))
+
+    if len(self._pending) >= self.max_batch:
+      self._flush()
+    elif self._timer is None:
+      self._timer = loop.call_later(self.window, self._flush)
+
+    result, timings = await future
+    trace = _current_trace.get()
+    if trace is not None:
+      for stage, seconds in timings.items():
+        trace.add(stage, seconds)
+    if isinstance(result, Exception):
+      raise result
+    return result
+
+  def _flush(self):
+    if self._timer is not None:
+      self._timer.cancel()
+      self._timer = None
+
+    batch, self._pending = self._pending, []
+    for chunk in _split_batch(batch, self.engine.workers, self.max_batch):
+      task = asyncio.ensure_future(self._run(chunk))
+      self._tasks.add(task)
+      task.add_done_callback(self._tasks.discard)
+
+  async def _run(self, batch):
+    # Collect this job's stage timings separately and hand them to each caller
+    trace = RequestTrace()
+    _current_trace.set(trace)
+    try:
+      results = await self.engine.run(_embeddings_from_batch, [data for data, _ in batch])
+    except Exception as exc:
+      # Queue full or worker failure: every request in the batch sees it
+      for _, future in batch:
+        if not future.done():
+          future.set_exception(exc)
+      return
+
+    for (_, future), result in zip(batch, results):
+      if not future.done():  # done means the client went away
+        future.set_result((result, trace.timings))
+
+batcher = MicroBatcher(
+  engine,
+  window_ms=FACE_BATCH_WINDOW_MS,
+  max_batch=FACE_BATCH_MAX
+)
+
+class EmbeddingCache:
+  """LRU cache of embeddings keyed by a hash of the image bytes.
+
+  Bounded by the bytes held in embeddings, with an optional TTL.
+  Used from the event loop only.
+  """
+
+  # Rough per-entry cost of the key, timestamp and OrderedDict node
+  ENTRY_OVERHEAD = 128
+
+  def __init__(self, max_bytes=0, ttl=0.0):
+    self.max_bytes = max_bytes
+    self.ttl = ttl
+    self.bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._entries = OrderedDict()
+
+  def __len__(self):
+    return len(self._entries)
+
+  @property
+  def enabled(self):
+    return self.max_bytes > 0
+
+  @staticmethod
+  def key(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+  def _size(self, embedding):
+    return embedding.nbytes + self.ENTRY_OVERHEAD
+
+  def _drop(self, key):
+    embedding, _ = self._entries.pop(key)
+    self.bytes -= self._size(embedding)
+
+  def get(self, key):
+    entry = self._entries.get(key)
+    if entry is not None and self.ttl and time.monotonic() - entry[1] > self.ttl:
+      self._drop(key)
+      entry = None
+    if entry is None:
+      self.misses += 1
+      return None
+    self._entries.move_to_end(key)
+    self.hits += 1
+    return entry[0]
+
+  def put(self, key, embedding):
+    embedding = np.array(embedding, dtype=np.float32)
+    embedding.setflags(write=False)  # shared between requests
+    size = self._size(embedding)
+    if size > self.max_bytes:
+      return
+    if key in self._entries:
+      self._drop(key)
+    self._entries[key] = (embedding, time.monotonic())
+    self.bytes += size
+    while self.bytes > self.max_bytes:
+      self._drop(next(iter(self._entries)))
+      self.evictions += 1
+
+  def status(self):
+    lookups = self.hits + self.misses
+    return {
+      "enabled": self.enabled,
+      "entries": len(self._entries),
+      "bytes": self.bytes,
+      "max_bytes": self.max_bytes,
+      "ttl": self.ttl,
+      "hits": self.hits,
+      "misses": self.misses,
+      "evictions": self.evictions,
+      "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+    }
+
+embedding_cache = EmbeddingCache(
+  max_bytes=FACE_CACHE_MAX_BYTES,
+  ttl=FACE_CACHE_TTL
+)
+
+async def _compute_embedding(data: bytes):
+  """Embedding for image bytes, served from the cache when possible"""
+  try:
+    if not embedding_cache.enabled:
+      return await batcher.submit(data)
+
+    key = EmbeddingCache.key(data)
+    embedding = embedding_cache.get(key)
+    if embedding is None:
+      embedding = await batcher.submit(data)
+      embedding_cache.put(key, embedding)
+    return embedding
+  except NoFaceError:
+    _mark_outcome("no_face")
+    raise
+  except InvalidImageError:
+    _mark_outcome("invalid_image")
+    raise
+
+class EmbeddingIndex:
+  """Enrolled embeddings as a contiguous, normalized float32 matrix.
+
+  Rows live in a memory-mapped .npy file preallocated to a capacity that
+  doubles as needed, so a restart maps the file instead of parsing it and
+  an enrollment writes a single row. User ids, in row order, are kept in
+  a small JSON manifest that is replaced atomically after each change,
+  together with the pipeline that produced the embeddings (None for
+  indexes written before it was recorded).
+
+  Reads and single-row writes run on the event loop. Growing the file
+  copies every row, so callers reserve() capacity in a thread first;
+  mutations must be serialized by the caller (see _index_lock).
+  """
+
+  def __init__(self, directory, dim=EMBEDDING_SIZE, initial_capacity=1024):
+    self.directory = directory
+    self.dim = dim
+    self.initial_capacity = initial_capacity
+    self.pipeline = None
+    self._matrix_path = os.path.join(directory, "embeddings.npy")
+    self._manifest_path = os.path.join(directory, "index.json")
+    self._ids = []
+    self._rows = {}
+    self._matrix = None
+    self._load()
+
+  def __len__(self):
+    return len(self._ids)
+
+  def __contains__(self, user_id):
+    return user_id in self._rows
+
+  def _load(self):
+    if not (os.path.exists(self._manifest_path) and os.path.exists(self._matrix_path)):
+      return
+    with open(self._manifest_path, "r", encoding="utf-8") as fh:
+      manifest = json.load(fh)
+    if manifest.get("dim") != self.dim:
+      raise ValueError(f"Index dimension {manifest.get('dim')} does not match {self.dim}")
+    self._matrix = np.load(self._matrix_path, mmap_mode="r+")
+    self.pipeline = manifest.get("pipeline")
+    self._ids = list(manifest["ids"])
+    self._rows = {user_id: row for row, user_id in enumerate(self._ids) if user_id is not None}
+    # A None id is a removal interrupted before its hole was filled
+    for row in reversed(range(len(self._ids))):
+      if self._ids[row] is None:
+        self._fill_hole(row)
+
+  def _write_manifest(self):
+    tmp_path = self._manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+      json.dump({"version": 1, "dim": self.dim, "pipeline": self.pipeline, "ids": self._ids}, fh)
+    os.replace(tmp_path, self._manifest_path)
+
+  @property
+  def capacity(self):
+    return 0 if self._matrix is None else self._matrix.shape[0]
+
+  def reserve(self, rows):
+    """Grow the matrix file to hold at least rows embeddings.
+
+    Safe to call from a worker thread while the loop keeps searching the
+    current mapping, provided no mutation runs concurrently.
+    """
+    capacity = self.capacity
+    if rows <= capacity:
+      return
+    new_capacity = max(self.initial_capacity, capacity * 2, rows)
+    os.makedirs(self.directory, exist_ok=True)
+    tmp_path = self._matrix_path + ".tmp"
+    grown = np.lib.format.open_memmap(
+      tmp_path, mode="w+", dtype=np.float32, shape=(new_capacity, self.dim)
+    )
+    if capacity:
+      grown[:len(self._ids)] = self._matrix[:len(self._ids)]
+    grown.flush()
+    del grown
+    os.replace(tmp_path, self._matrix_path)
+    self._matrix = np.load(self._matrix_path, mmap_mode="r+")
+
+  def _normalize(self, embedding):
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    if vector.shape[0] != self.dim:
+      raise ValueError(f"Embedding must have {self.dim} values, got {vector.shape[0]}")
+    return vector / (np.linalg.norm(vector) + 1e-8)
+
+  def add(self, user_id, embedding, pipeline=None):
+    """Insert or replace the embedding for user_id"""
+    vector = self._normalize(embedding)
+    if pipeline is not None:
+      if self._ids and self.pipeline not in (None, pipeline):
+        raise ValueError(f"Index holds {self.pipeline} embeddings, not {pipeline}")
+      if not self._ids:
+        self.pipeline = pipeline
+    row = self._rows.get(user_id)
+    if row is None:
+      row = len(self._ids)
+      self.reserve(row + 1)
+      self._ids.append(user_id)
+      self._rows[user_id] = row
+    self._matrix[row] = vector
+    self._matrix.flush()
+    self._write_manifest()
+
+  def remove(self, user_id):
+    """Remove user_id, moving the last row into its slot"""
+    row = self._rows.pop(user_id, None)
+    if row is None:
+      return False
+    # Persist the removal before touching rows: a crash mid-move then
+    # leaves a hole that _load fills, never an id pointing at another
+    # user's vector
+    self._ids[row] = None
+    self._write_manifest()
+    self._fill_hole(row)
+    return True
+
+  def _fill_hole(self, row):
+    last = len(self._ids) - 1
+    if row != last:
+      moved_id = self._ids[last]
+      self._matrix[row] = self._matrix[last]
+      self._matrix.flush()
+      self._ids[row] = moved_id
+      self._rows[moved_id] = row
+    self._ids.pop()
+    self._write_manifest()
+
+  def get(self, user_id):
+    """Normalized embedding for user_id, or None"""
+    row = self._rows.get(user_id)
+    if row is None:
+      return None
+    return np.array(self._matrix[row])
+
+  def ids(self, offset=0, limit=None):
+    if offset < 0 or (limit is not None and limit < 0):
+      raise ValueError("offset and limit must not be negative")
+    end = None if limit is None else offset + limit
+    return self._ids[offset:end]
+
+  def search(self, embedding, top_k=5, exclude=None):
+    """Return [(user_id, distance)] for the top_k nearest enrollments"""
+    count = len(self._ids)
+    if count == 0:
+      return []
+    query = self._normalize(embedding)
+    distances = 1.0 - self._matrix[:count] @ query
+    if exclude is not None and exclude in self._rows:
+      distances[self._rows[exclude]] = np.inf
+
+    top_k = min(top_k, count)
+    if top_k < count:
+      candidates = np.argpartition(distances, top_k - 1)[:top_k]
+    else:
+      candidates = np.arange(count)
+    order = candidates[np.argsort(distances[candidates])]
+    return [
+      (self._ids[row], float(distances[row]))
+      for row in order
+      if np.isfinite(distances[row])
+    ]
+
+index = EmbeddingIndex(FACE_INDEX_DIR)
+
+# Serializes enroll/remove so a capacity copy in a thread never races a write
+_index_lock = asyncio.Lock()
+
+def _check_index_pipeline():
+  """409 when the index was built by a different pipeline than the service runs"""
+  if len(index) and index.pipeline not in (None, FACE_PIPELINE):
+    raise HTTPException(
+      status_code=409,
+      detail=(
+        f"Enrollment index holds {index.pipeline} embeddings but the service runs {FACE_PIPELINE}; "
+        f"set FACE_PIPELINE={index.pipeline} or re-enroll into a new FACE_INDEX_DIR"
+      )
+    )
+
+def _match_result(user_id, distance):
+  return {
+    "user_id": user_id,
+    "distance": round(distance, 4),
+    "confidence": round(max(0.0, 1.0 - distance), 4),
+    "verified": distance < MATCH_THRESHOLD
+  }
+
+_http_in_flight = 0
+
+metrics.callback("face_queue_depth", "gauge", "Inference jobs waiting for a worker", lambda: engine.queued)
+metrics.callback("face_inference_in_flight", "gauge", "Inference jobs running on workers", lambda: engine.in_flight)
+metrics.callback("face_http_requests_in_flight", "gauge", "HTTP requests being handled", lambda: _http_in_flight)
+metrics.callback("face_cache_hits_total", "counter", "Embedding cache hits", lambda: embedding_cache.hits)
+metrics.callback("face_cache_misses_total", "counter", "Embedding cache misses", lambda: embedding_cache.misses)
+metrics.callback("face_cache_evictions_total", "counter", "Embedding cache evictions", lambda: embedding_cache.evictions)
+metrics.callback("face_cache_bytes", "gauge", "Bytes held by the embedding cache", lambda: embedding_cache.bytes)
+metrics.callback("face_index_size", "gauge", "Enrolled embeddings", lambda: len(index))
+
+def _route_path(scope):
+  """Route template for a request, keeping metric label cardinality low"""
+  for route in app.router.routes:
+    match, _ = route.matches(scope)
+    if match == Match.FULL:
+      return route.path
+  return "unmatched"
+
+def _status_outcome(status_code):
+  """Outcome for requests whose handler did not set one"""
+  if status_code == 413:
+    return "too_large"
+  if status_code == 503:
+    return "busy"
+  if status_code >= 500:
+    return "error"
+  if status_code >= 400:
+    return "client_error"
+  return "success"
+
+def _server_timing(timings, total):
+  entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+  entries.append(f"total;dur={total * 1000:.1f}")
+  return ", ".join(entries)
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+  """Count requests, time them and expose stage timings via Server-Timing"""
+  global _http_in_flight
+  endpoint = _route_path(request.scope)
+  trace = RequestTrace()
+  token = _current_trace.set(trace)
+  _http_in_flight += 1
+  start = time.perf_counter()
+  try:
+    response = await call_next(request)
+  except Exception:
+    metrics.inc("face_requests_total", {"endpoint": endpoint, "outcome": "error"})
+    raise
+  finally:
+    _http_in_flight -= 1
+    _current_trace.reset(token)
+
+  elapsed = time.perf_counter() - start
+  outcome = trace.outcome or _status_outcome(response.status_code)
+  metrics.inc("face_requests_total", {"endpoint": endpoint, "outcome": outcome})
+  metrics.observe("face_request_duration_seconds", elapsed, {"endpoint": endpoint})
+  response.headers["Server-Timing"] = _server_timing(trace.timings, elapsed)
+
+  if (
+    FACE_SLOW_REQUEST_MS
+    and elapsed * 1000 >= FACE_SLOW_REQUEST_MS
+    and random.random() < FACE_SLOW_SAMPLE_RATE
+  ):
+    stages = ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in trace.timings.items())
+    print(
+      f"🐢 Slow request: {request.method} {endpoint} -> {response.status_code} ({outcome}) "
+      f"in {elapsed * 1000:.1f}ms [{stages}] queue={engine.queued} in_flight={engine.in_flight}"
+    )
+
+  return response
+
+@app.get("/metrics")
+async def get_metrics():
+  """Prometheus text-format metrics"""
+  return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 async def root():
@@ -116,7 +1225,7 @@ async def root():
     "model": "MediaPipe Face Mesh",
     "version": "5.0",
     "memory_optimized": True,
-    "embedding_size": 468 * 3  # 468 landmarks × 3 coordinates
+    "embedding_size": EMBEDDING_SIZE
   }
 
 @app.get("/health")
@@ -127,56 +1236,121 @@ async def health():
     "service": "face-verification",
     "ready": True,
     "memory_optimized": True,
-    "embedding_size": 468 * 3
+    "embedding_size": EMBEDDING_SIZE,
+    "pipeline": FACE_PIPELINE,
+    "engine": engine.status(),
+    "cache": embedding_cache.status(),
+    "index_size": len(index),
+    "streams": len(_stream_sessions)
   }
 
 @app.post("/get-embedding")
-async def get_embedding(image: UploadFile = File(...)):
-  """Extract face embedding from image using MediaPipe Face Mesh"""
-  temp_path = None
+async def get_embedding(image: UploadFile = File(...), encoding: str = "json"):
+  """Extract face embedding from image using MediaPipe Face Mesh.
+
+  encoding: json (float list), f32/f16 (base64 packed string) or binary
+  (packed float32 as an application/octet-stream body).
+  """
+  _check_encoding(encoding)
+  data = await _read_upload(image)
   try:
-    temp_path = _save_upload(image)
-    
-    # Load image
-    image_data = cv2.imread(temp_path)
-    if image_data is None:
-      raise ValueError("Invalid image format")
-    
-    # Extract face region
-    face_region = _extract_face_region(image_data)
-    if face_region is None:
-      raise ValueError("No face detected in image")
-    
-    # Get embedding from landmarks
-    embedding = _face_region_to_embedding(face_region)
+    # Decode, detection and landmarks run on an inference worker
+    embedding = await _compute_embedding(data)
     
+    if encoding == "binary":
+      with _stage("serialization"):
+        packed = _pack_embedding(embedding, "f32")
+      return Response(
+        content=packed,
+        media_type="application/octet-stream",
+        headers={"X-Embedding-Size": str(len(embedding)), "X-Embedding-Pipeline": FACE_PIPELINE}
+      )
+
     return {
       "success": True,
-      "embedding": embedding,
+      "embedding": _encode_embedding(embedding, encoding),
+      "encoding": encoding,
+      "pipeline": FACE_PIPELINE,
       "model": "MediaPipe-FaceMesh",
       "embedding_size": len(embedding),
       "face_detected": True
     }
     
+  except QueueFullError:
+    raise _busy_error()
   except ValueError as ve:
     raise HTTPException(status_code=400, detail=f"Face detection failed: {str(ve)}")
   except Exception as exc:
     print(f"❌ Embedding extraction error: {exc}")
     raise HTTPException(status_code=500, detail=f"Embedding extraction failed: {str(exc)}")
-  finally:
-    if temp_path and os.path.exists(temp_path):
-      os.unlink(temp_path)
+
+@app.post("/get-embeddings-batch")
+async def get_embeddings_batch(images: List[UploadFile] = File(...), encoding: str = "json"):
+  """Extract face embeddings for many images, with per-image results"""
+  _check_encoding(encoding, ("json", "f32", "f16"))
+  if len(images) > FACE_BATCH_MAX_IMAGES:
+    raise HTTPException(
+      status_code=400,
+      detail=f"Too many images (max {FACE_BATCH_MAX_IMAGES})"
+    )
+
+  results = [None] * len(images)
+  accepted = []
+  for position, image in enumerate(images):
+    try:
+      accepted.append((position, await _read_upload(image)))
+    except HTTPException as he:
+      results[position] = {"index": position, "success": False, "status": he.status_code, "error": he.detail}
+
+  try:
+    # One chunk per worker (at most FACE_BATCH_MAX images) so every worker shares the batch
+    chunks = _split_batch(accepted, engine.workers, FACE_BATCH_MAX)
+    outputs = await asyncio.gather(*[
+      engine.run(_embeddings_from_batch, [data for _, data in chunk])
+      for chunk in chunks
+    ])
+  except QueueFullError:
+    raise _busy_error()
+  except Exception as exc:
+    print(f"❌ Batch embedding error: {exc}")
+    raise HTTPException(status_code=500, detail=f"Embedding extraction failed: {str(exc)}")
+
+  for chunk, output in zip(chunks, outputs):
+    for (position, _), result in zip(chunk, output):
+      if isinstance(result, ValueError):
+        results[position] = {"index": position, "success": False, "status": 400, "error": f"Face detection failed: {str(result)}"}
+      elif isinstance(result, Exception):
+        print(f"❌ Embedding extraction error: {result}")
+        results[position] = {"index": position, "success": False, "status": 500, "error": f"Embedding extraction failed: {str(result)}"}
+      else:
+        results[position] = {"index": position, "success": True, "embedding": _encode_embedding(result, encoding), "embedding_size": len(result)}
+
+  for position, image in enumerate(images):
+    results[position]["filename"] = image.filename
+
+  return {
+    "success": True,
+    "count": len(results),
+    "succeeded": sum(1 for r in results if r["success"]),
+    "results": results,
+    "encoding": encoding,
+    "pipeline": FACE_PIPELINE,
+    "model": "MediaPipe-FaceMesh"
+  }
 
 @app.post("/compare-embeddings")
 async def compare_embeddings(
-  embA: list = Body(...),
-  embB: list = Body(...)
+  embA: Union[list, str] = Body(...),
+  embB: Union[list, str] = Body(...)
 ):
-  """Compare two embeddings using cosine distance"""
+  """Compare two embeddings (float lists or packed base64) using cosine distance"""
   try:
     # Convert to numpy arrays
-    arr_a = np.array(embA, dtype=np.float32)
-    arr_b = np.array(embB, dtype=np.float32)
+    arr_a, pipeline_a = _decode_embedding(embA)
+    arr_b, pipeline_b = _decode_embedding(embB)
+    _check_pipelines(pipeline_a, pipeline_b)
+    if arr_a.shape != arr_b.shape:
+      raise ValueError(f"Embedding sizes differ ({arr_a.size} vs {arr_b.size})")
     
     # Normalize
     arr_a = arr_a / (np.linalg.norm(arr_a) + 1e-8)
@@ -186,8 +1360,9 @@ async def compare_embeddings(
     distance = float(1.0 - np.dot(arr_a, arr_b))
     
     # Threshold for MediaPipe landmarks: < 0.1 = same person (99%+ similarity required)
-    threshold = 0.1
+    threshold = MATCH_THRESHOLD
     is_verified = distance < threshold
+    _mark_outcome("verified" if is_verified else "rejected")
     confidence = max(0.0, 1.0 - distance)
 
     return {
@@ -197,6 +1372,8 @@ async def compare_embeddings(
       "confidence": round(confidence, 4),
       "model": "MediaPipe-FaceMesh"
     }
+  except ValueError as ve:
+    raise HTTPException(status_code=400, detail=f"Invalid embedding: {str(ve)}")
   except Exception as exc:
     print(f"❌ Comparison error: {exc}")
     raise HTTPException(status_code=500, detail=f"Comparison failed: {str(exc)}")
@@ -207,31 +1384,19 @@ async def verify_face(
   imageB: UploadFile = File(...)
 ):
   """Compare two images directly using MediaPipe Face Mesh"""
-  temp_a = None
-  temp_b = None
+  data_a = await _read_upload(imageA)
+  data_b = await _read_upload(imageB)
 
   try:
-    temp_a = _save_upload(imageA)
-    temp_b = _save_upload(imageB)
-    
-    # Load images
-    img_a = cv2.imread(temp_a)
-    img_b = cv2.imread(temp_b)
-    
-    if img_a is None or img_b is None:
-      raise ValueError("Invalid image format")
-    
-    # Extract face regions
-    face_a = _extract_face_region(img_a)
-    face_b = _extract_face_region(img_b)
-    
-    if face_a is None or face_b is None:
+    # Both images are processed in parallel on inference workers
+    try:
+      emb_a, emb_b = await asyncio.gather(
+        _compute_embedding(data_a),
+        _compute_embedding(data_b)
+      )
+    except NoFaceError:
       raise ValueError("Face not detected in one or both images")
     
-    # Get embeddings
-    emb_a = _face_region_to_embedding(face_a)
-    emb_b = _face_region_to_embedding(face_b)
-    
     # Convert to numpy for comparison
     arr_a = np.array(emb_a, dtype=np.float32)
     arr_b = np.array(emb_b, dtype=np.float32)
@@ -242,8 +1407,9 @@ async def verify_face(
     
     # Compare
     distance = float(1.0 - np.dot(arr_a, arr_b))
-    threshold = 0.1
+    threshold = MATCH_THRESHOLD
     is_verified = distance < threshold
+    _mark_outcome("verified" if is_verified else "rejected")
     confidence = max(0.0, 1.0 - distance)
     
     return {
@@ -254,16 +1420,315 @@ async def verify_face(
       "model": "MediaPipe-FaceMesh"
     }
     
+  except QueueFullError:
+    raise _busy_error()
   except ValueError as ve:
     raise HTTPException(status_code=400, detail=f"Face detection failed: {str(ve)}")
   except Exception as exc:
     print(f"❌ Verification error: {exc}")
     raise HTTPException(status_code=500, detail=f"Verification failed: {str(exc)}")
+
+@app.get("/index")
+async def list_index(offset: int = Query(0, ge=0), limit: int = Query(100, ge=0)):
+  """List enrolled user ids"""
+  return {
+    "count": len(index),
+    "dim": index.dim,
+    "offset": offset,
+    "ids": index.ids(offset, limit)
+  }
+
+@app.post("/index/enroll")
+async def enroll_face(
+  user_id: str = Form(...),
+  image: UploadFile = File(...),
+  allow_duplicate: bool = Form(False)
+):
+  """Add or replace a user's face in the enrollment index"""
+  _check_index_pipeline()
+  data = await _read_upload(image)
+  try:
+    embedding = await _compute_embedding(data)
+  except QueueFullError:
+    raise _busy_error()
+  except ValueError as ve:
+    raise HTTPException(status_code=400, detail=f"Face detection failed: {str(ve)}")
+  except Exception as exc:
+    print(f"❌ Enrollment error: {exc}")
+    raise HTTPException(status_code=500, detail=f"Enrollment failed: {str(exc)}")
+
+  async with _index_lock:
+    # Refuse a face that is already enrolled under a different user
+    if FACE_DUPLICATE_THRESHOLD and not allow_duplicate:
+      nearest = index.search(embedding, top_k=1, exclude=user_id)
+      if nearest and nearest[0][1] < FACE_DUPLICATE_THRESHOLD:
+        duplicate_id, distance = nearest[0]
+        raise HTTPException(
+          status_code=409,
+          detail={
+            "message": "Face already enrolled for another user",
+            "duplicate": _match_result(duplicate_id, distance)
+          }
+        )
+
+    replaced = user_id in index
+    if not replaced and len(index) >= index.capacity:
+      # Growing copies the whole matrix; keep that off the event loop
+      await asyncio.to_thread(index.reserve, len(index) + 1)
+    index.add(user_id, embedding, FACE_PIPELINE)
+  return {
+    "success": True,
+    "user_id": user_id,
+    "replaced": replaced,
+    "count": len(index),
+    "embedding_size": len(embedding)
+  }
+
+@app.delete("/index/{user_id}")
+async def remove_face(user_id: str):
+  """Remove a user's face from the enrollment index"""
+  async with _index_lock:
+    removed = index.remove(user_id)
+  if not removed:
+    raise HTTPException(status_code=404, detail="User not enrolled")
+  return {"success": True, "user_id": user_id, "count": len(index)}
+
+@app.post("/identify")
+async def identify_face(
+  image: UploadFile = File(...),
+  top_k: int = Form(5)
+):
+  """Find the closest enrolled users for a face (1:N)"""
+  _check_index_pipeline()
+  data = await _read_upload(image)
+  try:
+    embedding = await _compute_embedding(data)
+  except QueueFullError:
+    raise _busy_error()
+  except ValueError as ve:
+    raise HTTPException(status_code=400, detail=f"Face detection failed: {str(ve)}")
+  except Exception as exc:
+    print(f"❌ Identification error: {exc}")
+    raise HTTPException(status_code=500, detail=f"Identification failed: {str(exc)}")
+
+  matches = [_match_result(user_id, distance) for user_id, distance in index.search(embedding, max(1, top_k))]
+  _mark_outcome("verified" if matches and matches[0]["verified"] else "rejected")
+  return {
+    "identified": bool(matches) and matches[0]["verified"],
+    "matches": matches,
+    "threshold": MATCH_THRESHOLD,
+    "index_size": len(index),
+    "model": "MediaPipe-FaceMesh"
+  }
+
+class StreamSession:
+  """One live-verification stream.
+
+  Frames are embedded with the pipeline that produced the reference, since
+  embeddings from different pipelines are not comparable. Single-pass
+  streams get their own tracking-mode FaceMesh, which only re-runs its
+  detector when it loses the face, so later frames are much cheaper than
+  still uploads; two-stage streams run the still-image pipeline per frame.
+  Frames are processed one at a time, in order, on the stream executor.
+  """
+
+  def __init__(self, reference=None, pipeline=FACE_PIPELINE, required_matches=FACE_STREAM_REQUIRED_MATCHES, max_frames=FACE_STREAM_MAX_FRAMES):
+    self.reference = reference
+    self.pipeline = pipeline
+    self.required_matches = required_matches
+    self.max_frames = max_frames
+    self.frames = 0
+    self.matches = 0
+    self.best_distance = None
+    self._face_mesh = None
+
+  def embed(self, data):
+    """Stream worker job: embedding for one encoded frame"""
+    image_data = _decode_image(data)
+    if image_data is None:
+      raise InvalidImageError("Invalid image format")
+    if self.pipeline != "single-pass":
+      return _embedding_from_image(image_data, self.pipeline)
+    if self._face_mesh is None:
+      self._face_mesh = mp_face_mesh.FaceMesh(
+        static_image_mode=False,
+        max_num_faces=1,
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5
+      )
+    return _single_pass_embedding(image_data, self._face_mesh)
+
+  @property
+  def decided(self):
+    """True once the stream has matched, or can no longer match"""
+    remaining = self.max_frames - self.frames
+    return self.matches >= self.required_matches or self.matches + remaining < self.required_matches
+
+  def close(self):
+    if self._face_mesh is not None:
+      self._face_mesh.close()
+      self._face_mesh = None
+
+_stream_sessions = set()
+_stream_executor = None
+
+metrics.describe("face_stream_sessions_total", "counter", "Streaming verification sessions by outcome")
+metrics.callback("face_stream_sessions", "gauge", "Open streaming verification sessions", lambda: len(_stream_sessions))
+
+def _get_stream_executor():
+  global _stream_executor
+  if _stream_executor is None:
+    _stream_executor = ThreadPoolExecutor(
+      max_workers=FACE_STREAM_MAX_SESSIONS,
+      thread_name_prefix="face-stream"
+    )
+  return _stream_executor
+
+def _shutdown_streams():
+  global _stream_executor
+  if _stream_executor is not None:
+    _stream_executor.shutdown(wait=False, cancel_futures=True)
+    _stream_executor = None
+
+def _stream_reference(start):
+  """(reference embedding, its pipeline) from a stream's start message.
+
+  The pipeline comes from the index manifest or the packed header. JSON
+  lists carry none, so the start message may name it; otherwise the
+  service's own pipeline, which produced /get-embedding's output, is used.
+  """
+  declared = start.get("pipeline")
+  if declared is not None and declared not in PIPELINES:
+    raise ValueError(f"pipeline must be one of {PIPELINES}")
+
+  if start.get("user_id") is not None:
+    reference = index.get(str(start["user_id"]))
+    if reference is None:
+      raise ValueError("User not enrolled")
+    pipeline = index.pipeline
+  elif start.get("embedding") is not None:
+    reference, pipeline = _decode_embedding(start["embedding"])
+    if reference.shape[0] != EMBEDDING_SIZE:
+      raise ValueError(f"Embedding must have {EMBEDDING_SIZE} values")
+    reference = reference / (np.linalg.norm(reference) + 1e-8)
+  else:
+    raise ValueError("Start message needs a user_id or an embedding")
+
+  if declared is not None and pipeline is not None and declared != pipeline:
+    raise ValueError(f"Reference was produced by the {pipeline} pipeline, not {declared}")
+  return reference, pipeline or declared or FACE_PIPELINE
+
+async def _stream_embed(session, data):
+  """Run one frame on the stream executor, recording its stage timings"""
+  loop = asyncio.get_running_loop()
+  ok, value, log, _ = await loop.run_in_executor(_get_stream_executor(), _timed_call, session.embed, data)
+  for stage, seconds in log:
+    _record_stage(stage, seconds)
+  if not ok:
+    raise value
+  return value
+
+async def _close_stream(websocket, code, outcome, message=None):
+  metrics.inc("face_stream_sessions_total", {"outcome": outcome})
+  if message is not None:
+    await websocket.send_json(message)
+  await websocket.close(code=code)
+
+@app.websocket("/verify-stream")
+async def verify_stream(websocket: WebSocket):
+  """Live verification over a stream of camera frames.
+
+  Protocol: the first message is JSON, either {"user_id": ...} to compare
+  against the enrollment index or {"embedding": ...} (a float list or a
+  packed string), optionally with "pipeline" (for float lists),
+  "required_matches" and "max_frames".
+  Every later message is one encoded frame (binary; a text message closes
+  the stream with 1003). Each frame gets a
+  {"type": "frame"} reply. The stream ends with {"type": "result"} once
+  enough frames match, or once a match is no longer possible.
+  """
+  await websocket.accept()
+  if len(_stream_sessions) >= FACE_STREAM_MAX_SESSIONS:
+    await _close_stream(websocket, 1013, "busy", {"type": "error", "detail": "Face service is busy, please retry"})
+    return
+
+  # Sessions are capped (the slot is held from accept), and each one is
+  # evicted after FACE_STREAM_IDLE_TIMEOUT without a message
+  session = StreamSession()
+  _stream_sessions.add(session)
+  try:
+    try:
+      start = await asyncio.wait_for(websocket.receive_json(), FACE_STREAM_IDLE_TIMEOUT)
+      session.reference, session.pipeline = _stream_reference(start)
+      session.required_matches = min(FACE_STREAM_MAX_FRAMES, max(1, int(start.get("required_matches", FACE_STREAM_REQUIRED_MATCHES))))
+      session.max_frames = min(FACE_STREAM_MAX_FRAMES, max(session.required_matches, int(start.get("max_frames", FACE_STREAM_MAX_FRAMES))))
+    except asyncio.TimeoutError:
+      await _close_stream(websocket, 1000, "idle", {"type": "error", "detail": "No start message received"})
+      return
+    except (ValueError, TypeError, AttributeError) as exc:
+      await _close_stream(websocket, 1008, "error", {"type": "error", "detail": f"Invalid start message: {exc}"})
+      return
+
+    await websocket.send_json({
+      "type": "ready",
+      "pipeline": session.pipeline,
+      "required_matches": session.required_matches,
+      "max_frames": session.max_frames,
+      "threshold": MATCH_THRESHOLD
+    })
+
+    while not session.decided:
+      try:
+        message = await asyncio.wait_for(websocket.receive(), FACE_STREAM_IDLE_TIMEOUT)
+      except asyncio.TimeoutError:
+        await _close_stream(websocket, 1000, "idle", {"type": "error", "detail": "Stream idle, closing"})
+        return
+      if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+      data = message.get("bytes")
+      if data is None:
+        # A client protocol error, not a server fault: 1003 = unsupported data
+        await _close_stream(websocket, 1003, "error", {"type": "error", "detail": "Frames must be binary messages"})
+        return
+
+      session.frames += 1
+      reply = {"type": "frame", "frame": session.frames}
+      if len(data) > FACE_MAX_UPLOAD_BYTES:
+        reply.update({"face_detected": False, "error": f"Frame too large (max {FACE_MAX_UPLOAD_BYTES} bytes)"})
+      else:
+        try:
+          embedding = await _stream_embed(session, data)
+          distance = float(1.0 - np.dot(session.reference, embedding))
+          verified = distance < MATCH_THRESHOLD
+          session.matches += int(verified)
+          if session.best_distance is None or distance < session.best_distance:
+            session.best_distance = distance
+          reply.update({"face_detected": True, "distance": round(distance, 4), "verified": verified})
+        except ValueError as ve:
+          reply.update({"face_detected": False, "error": f"Face detection failed: {str(ve)}"})
+      reply["matches"] = session.matches
+      await websocket.send_json(reply)
+
+    verified = session.matches >= session.required_matches
+    best = session.best_distance
+    await _close_stream(websocket, 1000, "verified" if verified else "rejected", {
+      "type": "result",
+      "verified": verified,
+      "frames": session.frames,
+      "matches": session.matches,
+      "distance": None if best is None else round(best, 4),
+      "threshold": MATCH_THRESHOLD,
+      "confidence": None if best is None else round(max(0.0, 1.0 - best), 4),
+      "model": "MediaPipe-FaceMesh"
+    })
+  except WebSocketDisconnect:
+    metrics.inc("face_stream_sessions_total", {"outcome": "disconnected"})
+  except Exception as exc:
+    print(f"❌ Stream verification error: {exc}")
+    await _close_stream(websocket, 1011, "error", {"type": "error", "detail": f"Verification failed: {str(exc)}"})
   finally:
-    if temp_a and os.path.exists(temp_a):
-      os.unlink(temp_a)
-    if temp_b and os.path.exists(temp_b):
-      os.unlink(temp_b)
+    _stream_sessions.discard(session)
+    session.close()
 
 if __name__ == "__main__":
   import uvicorn